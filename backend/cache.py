@@ -0,0 +1,79 @@
+"""Caching for the results of slow async lookups."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """Remember lookup results for a fixed amount of time.
+
+    At most maxsize results are kept, dropping the least recently used first.
+    """
+
+    def __init__(self, ttl: timedelta, maxsize: int = 10_000) -> None:
+        self.ttl = ttl.total_seconds()
+        self.maxsize = maxsize
+
+        # Key -> (expiry time, value), from least to most recently used
+        self._values: dict[K, tuple[float, V]] = {}
+        # Key -> Lookup that is currently running
+        self._pending: dict[K, asyncio.Task[V]] = {}
+        # Lookup -> How many callers are waiting for it
+        self._waiters: dict[asyncio.Task[V], int] = {}
+
+    async def get(self, key: K, fetch: Callable[[], Awaitable[V]]) -> V:
+        """Return the value for a key, calling fetch if it is not cached.
+
+        Concurrent calls for the same key share a single fetch. Cancelling one
+        of the callers does not cancel the fetch for the others, but once they
+        have all been cancelled the fetch is too.
+        """
+        entry = self._values.pop(key, None)
+        if entry is not None:
+            expiry, value = entry
+            if time.monotonic() < expiry:
+                # Move it to the most recently used end
+                self._values[key] = entry
+                return value
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, fetch))
+            task.add_done_callback(_retrieve_exception)
+            # An eager task may have finished already
+            if not task.done():
+                self._pending[key] = task
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                # Nobody is left to use the result, so stop looking it up
+                task.cancel()
+
+    async def _fetch(self, key: K, fetch: Callable[[], Awaitable[V]]) -> V:
+        try:
+            value = await fetch()
+        finally:
+            self._pending.pop(key, None)
+        self._values[key] = (time.monotonic() + self.ttl, value)
+        if len(self._values) > self.maxsize:
+            del self._values[next(iter(self._values))]
+        return value
+
+
+def _retrieve_exception(task: asyncio.Task) -> None:
+    # A failed lookup may have no callers left to see the error, which asyncio
+    # would otherwise log as never retrieved
+    if not task.cancelled():
+        task.exception()
@@ -1,64 +1,97 @@
 import asyncio
 import logging
+import random
 
 import zmq
 import zmq.asyncio
-from aiohttp import ClientSession, ClientTimeout
+from aiohttp import ClientError, ClientSession, ClientTimeout
 from constants import EVENTS_URL
-from dustkid_schema import Event
 
 logger = logging.getLogger("dustkid")
 
 DUSTKID_URL = "http://dustkid.com/backend/events.php"
-NO_TIMEOUT = ClientTimeout(total=None, connect=None, sock_read=None, sock_connect=None)
+# The stream never ends, but dustkid sends heartbeats so a silent connection is dead
+STREAM_TIMEOUT = ClientTimeout(total=None, connect=10, sock_read=60, sock_connect=10)
+
+# Separates events in the stream, an empty event is a heartbeat
+SEPARATOR = b"\x1e"
 
 DEFAULT_BACKOFF_SECONDS = 1
+MAX_BACKOFF_SECONDS = 60
+
+# Read the stream in large blocks so bursts of events are handled together
+READ_CHUNK_SIZE = 2**16
+READ_BUFFER_SIZE = 2**20
 
 
 async def dustkid_events(context: zmq.asyncio.Context) -> None:
-    """Read events from dustkid and PUBlish them to a ZMQ socket."""
+    """Read events from dustkid and PUBlish them to a ZMQ socket.
+
+    Each message has one frame per event. Events are passed through as-is, it
+    is up to subscribers to validate them.
+    """
 
     socket = context.socket(zmq.PUB)
+    # PUB silently drops messages past the high water mark, so leave plenty of
+    # headroom for bursts while the server is busy
+    socket.setsockopt(zmq.SNDHWM, 10_000)
     socket.bind(EVENTS_URL)
 
     backoff_seconds = DEFAULT_BACKOFF_SECONDS
 
     while True:
-        async with ClientSession(timeout=NO_TIMEOUT) as session:
-            async with session.get(DUSTKID_URL) as response:
-                buffer = b""
-                async for chunk in response.content.iter_any():
+        try:
+            async with ClientSession(
+                timeout=STREAM_TIMEOUT, read_bufsize=READ_BUFFER_SIZE
+            ) as session, session.get(DUSTKID_URL) as response:
+                buffer = bytearray()
+                async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
                     if context.closed:
                         logger.info("Context closed, shutting down")
                         socket.close()
                         return
 
+                    backoff_seconds = DEFAULT_BACKOFF_SECONDS
+
                     buffer += chunk
-                    *events, buffer = buffer.split(b"\x1e")
-                    for event in events:
 
-                        if not event:
-                            logger.debug("Got heartbeat")
-                            continue
-                        try:
-                            parsed = Event.parse_raw(event)
-                        except ValueError as error:
-                            logger.warning(
-                                "Could not parse event: %s\n%s", event, error
-                            )
-                            continue
-                        logger.debug("Parsed event: %s", parsed)
+                    # Anything before this chunk has already been searched
+                    end = buffer.find(SEPARATOR, len(buffer) - len(chunk))
+                    if end == -1:
+                        continue
+
+                    # Walk the complete events with a cursor, then drop them from
+                    # the buffer in one go, to avoid copying the tail repeatedly
+                    events = []
+                    start = 0
+                    with memoryview(buffer) as view:
+                        while end != -1:
+                            event = bytes(view[start:end])
+                            start = end + 1
+                            end = buffer.find(SEPARATOR, start)
+
+                            if not event:
+                                logger.debug("Got heartbeat")
+                                continue
+                            events.append(event)
+                    del buffer[:start]
 
+                    # Publish every event from this chunk as one multipart message.
+                    # The events are immutable bytes, so libzmq can use them
+                    # without a copy or any tracking.
+                    if events:
                         try:
-                            await socket.send(event)
+                            await socket.send_multipart(events, copy=False)
                         except zmq.ContextTerminated:
                             logger.info("Context terminated, shutting down")
                             return
+        except (asyncio.TimeoutError, ClientError) as error:
+            logger.warning("Dustkid event stream failed: %r", error)
 
-                    backoff_seconds = DEFAULT_BACKOFF_SECONDS
-
+        # Jitter the delay so reconnects are spread out
+        delay_seconds = backoff_seconds * random.uniform(0.5, 1)
         logger.warning(
-            "Dustkid event stream closed, trying again in %s seconds", backoff_seconds
+            "Dustkid event stream closed, trying again in %.1f seconds", delay_seconds
         )
-        await asyncio.sleep(backoff_seconds)
-        backoff_seconds *= 2
+        await asyncio.sleep(delay_seconds)
+        backoff_seconds = min(backoff_seconds * 2, MAX_BACKOFF_SECONDS)
@@ -1,17 +1,17 @@
-from pydantic import BaseModel
+import msgspec
 
 
-class Tag(BaseModel):
+class Tag(msgspec.Struct, kw_only=True):
     version: str
-    release: str | None
+    release: str | None = None
     mode: str
-    filth: str | None
+    filth: str | None = None
     collected: str
-    apples: str | None
-    genocide: str | None
+    apples: str | None = None
+    genocide: str | None = None
 
 
-class Event(BaseModel):
+class Event(msgspec.Struct):
     rid: str
     user: int
     level: str
@@ -41,7 +41,7 @@ class Event(BaseModel):
     pb: bool
 
 
-class Score(BaseModel):
+class Score(msgspec.Struct):
     user: int
     timestamp: int
     level: str
@@ -64,6 +64,11 @@ class Score(BaseModel):
     replay: int
 
 
-class Leaderboard(BaseModel):
+class Leaderboard(msgspec.Struct):
     scores: dict[str, Score]
     times: dict[str, Score]
+
+
+# Dustkid is loose with its types, so coerce values like pydantic would
+EVENT_DECODER = msgspec.json.Decoder(Event, strict=False)
+LEADERBOARD_DECODER = msgspec.json.Decoder(Leaderboard, strict=False)
@@ -1,3 +1,7 @@
+import asyncio
+import os
+from datetime import timedelta
+
 import messages
 import zmq
 import zmq.asyncio
@@ -6,15 +10,61 @@ from quart import Quart, redirect
 
 app = Quart(__name__)
 
+# How many requests can talk to the backend at once
+BACKEND_POOL_SIZE = min(32, (os.cpu_count() or 1) * 4)
 
-@app.route("/api/create_lobby", methods=["POST"])
-async def create_lobby():
+# How long to wait for the backend to answer, in case the reply was lost
+BACKEND_TIMEOUT = timedelta(seconds=5)
+
+# Every request sends the same message, so only encode it once
+CREATE_LOBBY = messages.dump_bytes({"type": "create_lobby"})
+
+
+@app.before_serving
+async def use_eager_tasks():
+    # Start tasks immediately, skipping a loop iteration when they never block
+    asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
+
+def backend_socket() -> zmq.asyncio.Socket:
     context = zmq.asyncio.Context.instance()
     backend = context.socket(zmq.DEALER)
     backend.connect(CLIENTS_URL)
+    return backend
 
-    backend.send(messages.dump_bytes({"type": "create_lobby"}))
-    response: bytes = await backend.recv()  # type: ignore
+
+@app.before_serving
+async def connect_backend():
+    # The backend answers each socket's requests in order, so a socket is only
+    # used by one request/response pair at a time to keep them matched up
+    app.backend_pool = asyncio.Queue()
+    for _ in range(BACKEND_POOL_SIZE):
+        app.backend_pool.put_nowait(backend_socket())
+
+
+@app.after_serving
+async def disconnect_backend():
+    while not app.backend_pool.empty():
+        app.backend_pool.get_nowait().close()
+
+
+@app.route("/api/create_lobby", methods=["POST"])
+async def create_lobby():
+    backend = await app.backend_pool.get()
+    try:
+        await backend.send(CREATE_LOBBY)
+        response: bytes = await asyncio.wait_for(  # type: ignore
+            backend.recv(), BACKEND_TIMEOUT.total_seconds()
+        )
+    except BaseException as error:
+        # A response may still arrive on this socket, so replace it
+        backend.close(linger=0)
+        backend = backend_socket()
+        if not isinstance(error, asyncio.TimeoutError):
+            raise
+        return "Timed out creating lobby", 504
+    finally:
+        app.backend_pool.put_nowait(backend)
     message = messages.load(response)
 
     if message is None or message["type"] != "created_lobby":
@@ -2,32 +2,62 @@
 
 from __future__ import annotations
 
-import json
-from typing import Literal, TypedDict, cast
+from datetime import datetime
+from typing import Literal, TypedDict
+
+import msgspec
+
+_encoder = msgspec.json.Encoder()
+
+
+class _Header(msgspec.Struct):
+    type: str
+
+
+# Reads just the type, skipping over the rest of the message
+_header_decoder = msgspec.json.Decoder(_Header)
 
 
 def dump_str(message: Message) -> str:
     """Convert a message to a string."""
-    return json.dumps(message)
+    return _encoder.encode(message).decode()
 
 
 def dump_bytes(message: Message) -> bytes:
     """Convert a message to bytes."""
-    return dump_str(message).encode()
+    return _encoder.encode(message)
 
 
-def load(data: bytes | str) -> Message | None:
-    """Parse and validate a message from bytes or a string."""
+def load_type(data: bytes | memoryview | str) -> str | None:
+    """Read just the type of a message, without validating the rest of it."""
     try:
-        event = json.loads(data)
-    except ValueError:
+        return _header_decoder.decode(data).type
+    except msgspec.DecodeError:
         return None
-    if not isinstance(event, dict):
-        return None
-    if "type" not in event:
+
+
+def load(data: bytes | memoryview | str) -> Message | None:
+    """Parse and validate a message from a bytes-like object or a string."""
+    return _load(data, _decoders)
+
+
+def load_request(data: bytes | memoryview | str) -> Request | None:
+    """Parse and validate a message sent to the backend.
+
+    Only the types that the backend handles are accepted, anything else (such
+    as a state message from a client) is treated as invalid.
+    """
+    return _load(data, _request_decoders)
+
+
+def _load(data: bytes | memoryview | str, decoders: dict[str, msgspec.json.Decoder]):
+    try:
+        decoder = decoders.get(_header_decoder.decode(data).type)
+        if decoder is None:
+            return None
+        return decoder.decode(data)
+    except msgspec.DecodeError:
         return None
-    # FIXME: Should definitely be doing more validation to justify this cast
-    return cast(Message, event)
 
 
 # Client -> Frontend -> Backend
@@ -69,6 +99,9 @@ class Leave(TypedDict):
 
 # Frontend <-> Client
 
+# Frontends from before the websockets were kept alive with protocol pings
+# still send these, so they are answered until those have all been reloaded
+
 
 class Ping(TypedDict):
     type: Literal["ping"]
@@ -79,9 +112,12 @@ class Pong(TypedDict):
 
 
 # Backend -> Frontend -> Client
+#
+# These are built for every state broadcast, so they are structs rather than
+# dicts. None of them can form reference cycles, so they skip the GC.
 
 
-class Score(TypedDict):
+class Score(msgspec.Struct, gc=False):
     user_id: int
     user_name: str
     completion: int
@@ -89,7 +125,7 @@ class Score(TypedDict):
     time: int
 
 
-class Level(TypedDict):
+class Level(msgspec.Struct, gc=False):
     name: str
     play: str
     image: str
@@ -97,13 +133,13 @@ class Level(TypedDict):
     dustkid: str
 
 
-class Timer(TypedDict):
-    start: str
-    end: str
+class Timer(msgspec.Struct, gc=False):
+    # Encoded as RFC 3339 strings
+    start: datetime
+    end: datetime
 
 
-class State(TypedDict):
-    type: Literal["state"]
+class State(msgspec.Struct, gc=False, tag="state", tag_field="type"):
     lobby_id: int
     level: Level | None
     round_timer: Timer | None
@@ -113,4 +149,37 @@ class State(TypedDict):
     scores: list[Score]
 
 
-Message = CreateLobby | CreatedLobby | Error | Join | Leave | State | Ping | Pong
+Message = (
+    Login
+    | Logout
+    | CreateLobby
+    | CreatedLobby
+    | Error
+    | Join
+    | Leave
+    | Ping
+    | Pong
+    | State
+)
+Request = Login | Logout | CreateLobby | Join | Leave
+
+
+# Message type -> Decoder that validates a message of that type
+_decoders: dict[str, msgspec.json.Decoder] = {
+    "login": msgspec.json.Decoder(Login),
+    "logout": msgspec.json.Decoder(Logout),
+    "create_lobby": msgspec.json.Decoder(CreateLobby),
+    "created_lobby": msgspec.json.Decoder(CreatedLobby),
+    "error": msgspec.json.Decoder(Error),
+    "join": msgspec.json.Decoder(Join),
+    "leave": msgspec.json.Decoder(Leave),
+    "ping": msgspec.json.Decoder(Ping),
+    "pong": msgspec.json.Decoder(Pong),
+    "state": msgspec.json.Decoder(State),
+}
+
+# Message type -> Decoder, for just the messages that are sent to the backend
+_request_decoders = {
+    type: _decoders[type]
+    for type in ("login", "logout", "create_lobby", "join", "leave")
+}
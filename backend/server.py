@@ -1,22 +1,25 @@
 from __future__ import annotations
 
 import asyncio
-import json
+import functools
 import logging
 import random
 import re
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, timezone
 
 import messages
-import pydantic
+import msgspec
+import uvloop
 import zmq
 import zmq.asyncio
-from aiohttp import ClientSession
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from cache import TTLCache
 from constants import CLIENTS_URL, EVENTS_URL
 from dustkid import dustkid_events
-from dustkid_schema import Event, Leaderboard
+from dustkid_schema import EVENT_DECODER, LEADERBOARD_DECODER, Event
+from sortedcontainers import SortedKeyList
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("server")
@@ -29,72 +32,96 @@ MAX_LOBBY_COUNT = 100
 ROUND_DURATION = timedelta(minutes=10)
 BREAK_DURATION = timedelta(seconds=30)
 
+# How long to wait for more PBs before sending them, to batch up bursts of them
+SCORE_BROADCAST_DELAY = timedelta(milliseconds=100)
 
-async def get_level_filename(id: int) -> str | None:
+# How many random levels to try at once when looking for a new level
+RANDOM_LEVEL_ATTEMPTS = 4
+# How many random levels can be tried at once across all lobbies, to go easy on
+# atlas and dustkid when many lobbies change level together
+MAX_RANDOM_LEVEL_ATTEMPTS = 16
+random_level_attempts = asyncio.Semaphore(MAX_RANDOM_LEVEL_ATTEMPTS)
+
+FILENAME_PATTERN = re.compile('filename="([^"]*)"')
+
+# Level id -> filename, a level's filename never changes once it is uploaded
+level_filenames: TTLCache[int, str | None] = TTLCache(timedelta(hours=24))
+
+# Level filename -> stats, new SSes are rare enough that these stay good for a
+# while, and they only decide whether a level is picked
+level_stats: TTLCache[str, LevelStats] = TTLCache(timedelta(minutes=10))
+
+
+async def get_level_filename(id: int, session: ClientSession) -> str | None:
+    return await level_filenames.get(id, lambda: fetch_level_filename(id, session))
+
+
+async def fetch_level_filename(id: int, session: ClientSession) -> str | None:
     url = f"https://atlas.dustforce.com/gi/downloader.php?id={id}"
-    async with ClientSession() as session, session.head(url) as response:
+    async with session.head(url) as response:
         content_disposition = response.headers.get("Content-Disposition")
         if content_disposition is None:
             return None
 
-        m = re.search('filename="([^"]*)"', content_disposition)
+        m = FILENAME_PATTERN.search(content_disposition)
         if m is None:
             return None
 
         return m.group(1)
 
 
-@dataclass
-class Level:
-    filename: str
+@functools.lru_cache(maxsize=4096)
+def parse_level_id(filename: str) -> int | None:
+    """Return the id at the end of a level filename, if it has one."""
+    _, separator, id = filename.rpartition("-")
+    if not separator:
+        # Stock maps do not have ids
+        return None
+    try:
+        return int(id)
+    except ValueError:
+        logger.error("Could not parse level id: filename=%s", filename)
+        return None
 
-    @property
-    def id(self) -> int | None:
-        parts = self.filename.rsplit("-", 1)
-        if len(parts) != 2:
-            # Stock maps do not have ids
-            return None
-        try:
-            return int(parts[1])
-        except ValueError:
-            logger.error("Could not parse level id: filename=%s", self.filename)
-            return None
 
-    @property
-    def name(self) -> str:
-        return self.filename.rsplit("-", 1)[0].replace("-", " ")
+@dataclass(slots=True)
+class Level:
+    filename: str
 
-    @property
-    def image(self) -> str:
-        return f"https://atlas.dustforce.com/gi/maps/{self.filename}.png"
+    # Derived from the filename once, since they are read for every state sent
+    id: int | None = field(init=False, repr=False, compare=False)
+    name: str = field(init=False, repr=False, compare=False)
+    image: str = field(init=False, repr=False, compare=False)
+    install_play: str = field(init=False, repr=False, compare=False)
+    atlas: str | None = field(init=False, repr=False, compare=False)
+    dustkid: str = field(init=False, repr=False, compare=False)
 
-    @property
-    def install_play(self) -> str:
+    def __post_init__(self) -> None:
         parts = self.filename.rsplit("-", 1)
-        if len(parts) != 2:
-            # Stock maps do not have ids
-            return f"dustforce://installPlay/0/{self.filename}"
-        name, id = parts
-        return f"dustforce://installPlay/{id}/{name}"
+        self.name = parts[0].replace("-", " ")
+        self.image = f"https://atlas.dustforce.com/gi/maps/{self.filename}.png"
+        self.dustkid = f"https://dustkid.com/level/{self.filename}"
 
-    @property
-    def atlas(self) -> str | None:
-        parts = self.filename.rsplit("-", 1)
         if len(parts) != 2:
             # Stock maps do not have ids
-            return None
+            self.id = None
+            self.install_play = f"dustforce://installPlay/0/{self.filename}"
+            self.atlas = None
+            return
+
         name, id = parts
-        return f"https://atlas.dustforce.com/{id}/{name}"
+        self.id = parse_level_id(self.filename)
+        self.install_play = f"dustforce://installPlay/{id}/{name}"
+        self.atlas = f"https://atlas.dustforce.com/{id}/{name}"
 
-    @property
-    def dustkid(self) -> str:
-        return f"https://dustkid.com/level/{self.filename}"
+    async def stats(self, session: ClientSession) -> LevelStats:
+        return await level_stats.get(self.filename, lambda: self._fetch_stats(session))
 
-    async def stats(self) -> LevelStats:
+    async def _fetch_stats(self, session: ClientSession) -> LevelStats:
         url = f"https://dustkid.com/json/level/{self.filename}"
-        async with ClientSession() as session, session.get(url) as response:
+        async with session.get(url) as response:
             data = await response.read()
-            leaderboard = Leaderboard.parse_raw(data)
+            leaderboard = LEADERBOARD_DECODER.decode(data)
 
         ss_count = 0
         fastest_ss = None
@@ -115,37 +142,79 @@ class LevelStats:
     fastest_ss: int | None
 
 
+async def try_random_level(
+    session: ClientSession,
+    max_level_id: int,
+    min_ss_count: int,
+    max_fastest_ss: int,
+) -> Level | None:
+    """Pick a random level, returning it if it satisfies the constraints."""
+    level_id = random.randint(100, max_level_id)
+    logger.debug("Chose random level id %s", level_id)
+
+    try:
+        filename = await get_level_filename(level_id, session)
+    except (asyncio.TimeoutError, ClientError) as error:
+        logger.warning("Could not fetch level filename: id=%s %r", level_id, error)
+        return None
+    if filename is None:
+        logger.debug("Skipping level id %s because it has no filename", level_id)
+        return None
+
+    level = Level(filename)
+    try:
+        stats = await level.stats(session)
+    except msgspec.DecodeError:
+        logger.exception("Could not parse level data: filename=%s", filename)
+        return None
+    except (asyncio.TimeoutError, ClientError) as error:
+        logger.warning("Could not fetch level data: filename=%s %r", filename, error)
+        return None
+
+    if (
+        stats.ss_count < min_ss_count
+        or stats.fastest_ss is None
+        or stats.fastest_ss > max_fastest_ss
+    ):
+        logger.debug(
+            "Skipping level %s because it is does not satisfy the constraints",
+            filename,
+        )
+        return None
+
+    return level
+
+
 async def random_level(
-    max_level_id: int, min_ss_count: int = 5, max_fastest_ss: int = 45_000
+    session: ClientSession,
+    max_level_id: int,
+    min_ss_count: int = 5,
+    max_fastest_ss: int = 45_000,
 ) -> Level:
-    while True:
-        level_id = random.randint(100, max_level_id)
-        logger.debug("Chose random level id %s", level_id)
-
-        filename = await get_level_filename(level_id)
-        if filename is None:
-            logger.debug("Skipping level id %s because it has no filename", level_id)
-            continue
+    async def try_one() -> Level | None:
+        async with random_level_attempts:
+            return await try_random_level(
+                session, max_level_id, min_ss_count, max_fastest_ss
+            )
 
-        level = Level(filename)
+    # Most levels are rejected, so try several at once and take the first hit
+    while True:
+        attempts = [
+            asyncio.create_task(try_one()) for _ in range(RANDOM_LEVEL_ATTEMPTS)
+        ]
         try:
-            stats = await level.stats()
-        except pydantic.ValidationError:
-            logger.exception("Could not parse level data: filename=%s", filename)
-            continue
+            for done in asyncio.as_completed(attempts):
+                level = await done
+                if level is not None:
+                    return level
+        finally:
+            for task in attempts:
+                task.cancel()
 
-        if (
-            stats.ss_count < min_ss_count
-            or stats.fastest_ss is None
-            or stats.fastest_ss > max_fastest_ss
-        ):
-            logger.debug(
-                "Skipping level %s because it is does not satisfy the constraints",
-                filename,
-            )
-            continue
 
-        return level
+# User id -> name, users rarely rename so the same players rejoining can skip
+# the lookup
+user_names: TTLCache[int, str | None] = TTLCache(timedelta(hours=1))
 
 
 @dataclass
@@ -154,34 +223,52 @@ class User:
     name: str
 
     @staticmethod
-    async def create(id: int) -> User | None:
-        name = await User._fetch_name(id)
+    async def create(id: int, session: ClientSession) -> User | None:
+        if not (1 <= id <= 1_000_000):
+            return None
+        try:
+            name = await user_names.get(id, lambda: User._fetch_name(id, session))
+        except (asyncio.TimeoutError, ClientError) as error:
+            logger.warning("Could not fetch user name: id=%s %r", id, error)
+            return None
         if not name:
             return None
         return User(id, name)
 
     @staticmethod
-    async def _fetch_name(id: int) -> str | None:
-        if not (1 <= id <= 1_000_000):
-            return None
+    async def _fetch_name(id: int, session: ClientSession) -> str | None:
         url = f"https://df.hitboxteam.com/backend6/userSearch.php?userid={id}"
-        async with ClientSession() as session:
-            async with session.get(url) as response:
-                result = await response.json()
-                if len(result) != 1 or "name" not in result[0]:
-                    return None
-                return result[0]["name"]
+        async with session.get(url) as response:
+            result = await response.json()
+        if len(result) != 1 or "name" not in result[0]:
+            return None
+        return result[0]["name"]
+
+
+# The envelope frames a ROUTER receives before a client's message, starting
+# with the peer identity. Replies are sent back along the same route.
+Route = tuple[bytes, ...]
 
 
 @dataclass
 class Client:
     socket: zmq.asyncio.Socket
-    identity: bytes
+    route: Route
     user: User | None
     lobby: Lobby
 
-    async def send(self, message: bytes) -> None:
-        await self.socket.send_multipart([self.identity, message])
+    # The route wrapped once, since it starts every send
+    route_frames: list[zmq.Frame] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.route_frames = [zmq.Frame(part) for part in self.route]
+
+    def send(self, message: bytes | zmq.Frame) -> None:
+        # A ROUTER never blocks on send (it drops messages for peers that are
+        # not keeping up), so this always completes immediately
+        self.socket.send_multipart(
+            [*self.route_frames, message], flags=zmq.DONTWAIT, copy=False
+        )
 
 
 class BaseLobby(ABC):
@@ -192,10 +279,27 @@ class BaseLobby(ABC):
         self.closing: asyncio.Task | None = None
         self.on_close = asyncio.Event()
 
-        self.clients: dict[bytes, Client] = {}
+        self.clients: dict[Route, Client] = {}
+        # User id -> User for the logged in clients, see _update_users
+        self.users: dict[int, User] = {}
+        # User id -> name, shared by every state sent until the users change
+        self.user_names: dict[int, str] = {}
         self.scores: dict[int, Score] = {}
+        # (User id, score) for each score, kept sorted from worst to best
+        self.ranking = SortedKeyList(key=lambda item: self._scoring_key(item[1]))
         self.level: Level | None = None
-        self.round_end: datetime | None = None
+        # Only changes between rounds, so it is built then rather than per state
+        self.round_timer: messages.Timer | None = None
+        # When the round runs, as POSIX timestamps to compare events against
+        self.round_start_timestamp: float | None = None
+        self.round_end_timestamp: float | None = None
+
+        # A pending call to send the state, see send_state_soon
+        self._send_state_handle: asyncio.Handle | None = None
+        # The encoded state, until something in it changes
+        self._state_bytes: bytes | None = None
+        # The last state sent to all connected users
+        self._sent_state_bytes: bytes | None = None
 
         self._check_empty()
 
@@ -212,19 +316,59 @@ class BaseLobby(ABC):
     def _scoring_key(score: Score) -> tuple:
         """Return a key that will be used to rank this score."""
 
-    @property
-    def users(self) -> dict[int, User]:
-        return {
+    def _update_users(self) -> None:
+        """Rebuild the logged in users after a client leaves or (un)logs in."""
+        self.users = {
             client.user.id: client.user
             for client in self.clients.values()
             if client.user is not None
         }
+        self.user_names = {user.id: user.name for user in self.users.values()}
 
-    async def send_state(self) -> None:
+    def _state_message(self) -> bytes:
+        """Return the encoded state, reusing it if nothing has changed."""
+        if self._state_bytes is None:
+            self._state_bytes = messages.dump_bytes(self._state())
+        return self._state_bytes
+
+    def send_state(self) -> None:
         """Send the current state to all connected users."""
-        message = json.dumps(self._state()).encode()
-        for client in self.clients.values():
-            await client.send(message)
+        self._send_state_handle = None
+        message = self._state_message()
+        if message == self._sent_state_bytes:
+            # Nothing visible changed (eg. an update was undone before sending)
+            return
+        self._sent_state_bytes = message
+        if not self.clients:
+            return
+
+        # Wrap the message once, so every send shares the same buffer
+        frame = zmq.Frame(message)
+        # Every client is on the manager's ROUTER, so look up its send once
+        clients = self.clients.values()
+        send_multipart = next(iter(clients)).socket.send_multipart
+        for client in clients:
+            send_multipart(
+                [*client.route_frames, frame], flags=zmq.DONTWAIT, copy=False
+            )
+
+    def send_state_soon(self, delay: timedelta = timedelta()) -> None:
+        """Mark the state as changed and send it to all connected users.
+
+        The state is sent after the delay, once any other pending updates have
+        been handled, so several changes in that time (eg. a burst of dustkid
+        events) result in a single broadcast.
+        """
+        self._state_bytes = None
+        if self._send_state_handle is not None:
+            return
+        loop = asyncio.get_running_loop()
+        if delay:
+            self._send_state_handle = loop.call_later(
+                delay.total_seconds(), self.send_state
+            )
+        else:
+            self._send_state_handle = loop.call_soon(self.send_state)
 
     def _check_empty(self) -> None:
         """If no clients remain, schedule the lobby to be closed."""
@@ -250,26 +394,43 @@ class BaseLobby(ABC):
 
     async def on_join(self, client: Client) -> None:
         """Handle a new client joining."""
-        self.clients[client.identity] = client
+        self.clients[client.route] = client
         if self.closing:
             self.closing.cancel()
             self.closing = None
-        await self.send_state()
+        # Clients join logged out, which does not change the state, so only the
+        # new client needs it
+        client.send(self._state_message())
 
     async def on_leave(self, client: Client) -> None:
         """Handle a client leaving."""
-        self.clients.pop(client.identity)
+        self.clients.pop(client.route)
         self._check_empty()
-        await self.send_state()
+        if client.user is not None:
+            self._update_users()
+            self.send_state_soon()
+
+    def on_login(self, client: Client, user: User | None) -> None:
+        """Handle a client logging in, or out if user is None."""
+        client.user = user
+        self._update_users()
+        self.send_state_soon()
 
-    async def on_dustkid_event(self, event: Event) -> None:
+    def on_dustkid_event(self, event: Event) -> None:
         """Update scores and send state if this is a new best."""
         if self.level is None or event.level != self.level.filename:
             return
 
+        # Ignore runs from outside the round, eg. ones delayed from the last
+        # time this level was played
         if (
-            self.round_end is None
-            or datetime.fromtimestamp(event.timestamp, timezone.utc) > self.round_end
+            self.round_start_timestamp is None
+            or self.round_end_timestamp is None
+            or not (
+                self.round_start_timestamp
+                <= event.timestamp
+                <= self.round_end_timestamp
+            )
         ):
             return
 
@@ -279,8 +440,11 @@ class BaseLobby(ABC):
             new_score
         ):
             logger.info("Lobby(%s) User %s PB'd: %s", self.id, event.user, new_score)
+            if old_score is not None:
+                self.ranking.remove((event.user, old_score))
             self.scores[event.user] = new_score
-            await self.send_state()
+            self.ranking.add((event.user, new_score))
+            self.send_state_soon(SCORE_BROADCAST_DELAY)
 
 
 class Lobby(BaseLobby):
@@ -289,8 +453,11 @@ class Lobby(BaseLobby):
     lobbies: dict[int, Lobby] = {}
     next_id: int = 0
 
+    # Level filename -> Lobbies currently playing that level
+    by_level: dict[str, set[Lobby]] = {}
+
     @staticmethod
-    def create(id: int | None = None) -> Lobby | None:
+    def create(session: ClientSession, id: int | None = None) -> Lobby | None:
         if len(Lobby.lobbies) >= MAX_LOBBY_COUNT:
             logger.warning(
                 "Ignoring lobby create because there are %s existing lobbies",
@@ -306,7 +473,7 @@ class Lobby(BaseLobby):
             id = Lobby.next_id
             Lobby.next_id += 1
 
-        lobby = Lobby(id=id)
+        lobby = Lobby(id=id, session=session)
         Lobby.lobbies[id] = lobby
 
         async def run_lobby():
@@ -315,47 +482,56 @@ class Lobby(BaseLobby):
                 await lobby.run()
             finally:
                 del Lobby.lobbies[id]
+                lobby._set_level(None)
 
         asyncio.create_task(run_lobby())
         return lobby
 
-    def __init__(self, id: int):
+    def __init__(self, id: int, session: ClientSession):
         super().__init__(id)
 
-        self.break_end: datetime | None = None
+        self.session = session
+        self.break_timer: messages.Timer | None = None
         self.winner: str | None = None
+        # The level for the next round, found while the current one is played
+        self.next_level: asyncio.Task[Level] | None = None
 
     @staticmethod
     def _scoring_key(score: Score) -> tuple:
         return score.ss_key
 
     async def _run(self) -> None:
-        # Start the first round immediately
-        await self._end_round(timedelta())
-        while True:
-            # Give a couple of seconds of leeway to account for network delays
-            await asyncio.sleep(ROUND_DURATION.seconds + 2)
-            await self._end_round(BREAK_DURATION)
+        try:
+            # Start the first round immediately
+            await self._end_round(timedelta())
+            while True:
+                # Give a couple of seconds of leeway to account for network delays
+                await asyncio.sleep(ROUND_DURATION.seconds + 2)
+                await self._end_round(BREAK_DURATION)
+        finally:
+            if self.next_level is not None:
+                self.next_level.cancel()
 
     async def _end_round(self, break_time: timedelta) -> None:
         # Announce the winner
-        self.round_end = None
-        self.break_end = datetime.now(timezone.utc) + break_time
-        if self.scores:
-            self.winner = self.users[
-                sorted(
-                    self.scores,
-                    key=lambda user_id: self._scoring_key(self.scores[user_id]),
-                    reverse=True,
-                )[0]
-            ].name
+        self.round_timer = None
+        self.round_start_timestamp = None
+        self.round_end_timestamp = None
+        break_end = datetime.now(timezone.utc) + break_time
+        self.break_timer = messages.Timer(
+            start=break_end - BREAK_DURATION, end=break_end
+        )
+        if self.ranking:
+            winner_id, _ = self.ranking[-1]
+            self.winner = self.users[winner_id].name
             logger.info("Lobby(%s) %s wins!", self.id, self.winner)
-        await self.send_state()
+        self.send_state_soon()
 
-        # Find a new level during the break
-        new_level_task = asyncio.create_task(random_level(max_level_id=11_000))
+        # The next level is usually found during the round, but the first round
+        # has to look for one now
+        next_level = self.next_level or self._find_level()
         await asyncio.sleep(break_time.seconds)
-        new_level = await new_level_task
+        new_level = await next_level
 
         # Switch to new level
         logger.info(
@@ -363,83 +539,98 @@ class Lobby(BaseLobby):
         )
         self.winner = None
         self.scores = {}
-        self.level = new_level
-        self.round_end = datetime.now(timezone.utc) + ROUND_DURATION
-        self.break_end = None
-        await self.send_state()
+        self.ranking.clear()
+        self._set_level(new_level)
+        round_end = datetime.now(timezone.utc) + ROUND_DURATION
+        self.round_timer = messages.Timer(
+            start=round_end - ROUND_DURATION, end=round_end
+        )
+        self.round_end_timestamp = round_end.timestamp()
+        # Dustkid timestamps are whole seconds
+        self.round_start_timestamp = int(
+            self.round_end_timestamp - ROUND_DURATION.total_seconds()
+        )
+        self.break_timer = None
+        self.send_state_soon()
+
+        self.next_level = self._find_level()
+
+    def _find_level(self) -> asyncio.Task[Level]:
+        return asyncio.create_task(random_level(self.session, max_level_id=11_000))
+
+    def _set_level(self, level: Level | None) -> None:
+        """Change level, keeping the by_level index up to date."""
+        if self.level is not None:
+            lobbies = Lobby.by_level[self.level.filename]
+            lobbies.discard(self)
+            if not lobbies:
+                del Lobby.by_level[self.level.filename]
+
+        self.level = level
+        if level is not None:
+            Lobby.by_level.setdefault(level.filename, set()).add(self)
 
     def _state(self) -> messages.State:
-        scores: list[messages.Score] = [
-            {
-                "user_id": user_id,
-                "user_name": self.users[user_id].name,
-                "completion": score.completion,
-                "finesse": score.finesse,
-                "time": score.time,
-            }
-            for user_id, score in sorted(
-                self.scores.items(),
-                key=lambda kv: self._scoring_key(kv[1]),
-                reverse=True,
+        users = self.users
+
+        # Only users who are still here are ranked, the rest follow unscored
+        scores = [
+            messages.Score(
+                user_id=user_id,
+                user_name=users[user_id].name,
+                completion=score.completion,
+                finesse=score.finesse,
+                time=score.time,
             )
-            if user_id in self.users
+            for user_id, score in reversed(self.ranking)
+            if user_id in users
         ]
         scores.extend(
-            [
-                {
-                    "user_id": user_id,
-                    "user_name": self.users[user_id].name,
-                    "completion": 0,
-                    "finesse": 0,
-                    "time": 0,
-                }
-                for user_id in self.users
-                if user_id not in self.scores
-            ]
+            messages.Score(
+                user_id=user_id,
+                user_name=user.name,
+                completion=0,
+                finesse=0,
+                time=0,
+            )
+            for user_id, user in users.items()
+            if user_id not in self.scores
         )
 
-        state: messages.State = {
-            "type": "state",
-            "lobby_id": self.id,
-            "level": None,
-            "round_timer": None,
-            "winner": self.winner,
-            "break_timer": None,
-            "users": {user.id: user.name for user in self.users.values()},
-            "scores": scores,
-        }
-
+        level = None
         if self.level is not None:
-            state["level"] = {
-                "name": self.level.name,
-                "play": self.level.install_play,
-                "image": self.level.image,
-                "atlas": self.level.atlas,
-                "dustkid": self.level.dustkid,
-            }
-
-        if self.round_end is not None:
-            state["round_timer"] = {
-                "start": (self.round_end - ROUND_DURATION).isoformat(),
-                "end": self.round_end.isoformat(),
-            }
-
-        if self.break_end is not None:
-            state["break_timer"] = {
-                "start": (self.break_end - BREAK_DURATION).isoformat(),
-                "end": self.break_end.isoformat(),
-            }
+            level = messages.Level(
+                name=self.level.name,
+                play=self.level.install_play,
+                image=self.level.image,
+                atlas=self.level.atlas,
+                dustkid=self.level.dustkid,
+            )
 
-        return state
+        return messages.State(
+            lobby_id=self.id,
+            level=level,
+            round_timer=self.round_timer,
+            winner=self.winner,
+            break_timer=self.break_timer,
+            users=self.user_names,
+            scores=scores,
+        )
 
 
-@dataclass
+@dataclass(slots=True)
 class Score:
     completion: int
     finesse: int
     time: int
     timestamp: int
 
+    # Scores are compared whenever they are ranked, so build the key up front
+    ss_key: tuple[int, int, int] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.ss_key = self.completion + self.finesse, -self.time, -self.timestamp
+
     @staticmethod
     def from_dustkid_event(event: Event) -> Score:
         return Score(
@@ -449,18 +640,15 @@ class Score:
             event.timestamp,
         )
 
-    @property
-    def ss_key(self) -> tuple[int, int, int]:
-        return self.completion + self.finesse, -self.time, -self.timestamp
-
 
 class Manager:
-    def __init__(self, context: zmq.asyncio.Context) -> None:
+    def __init__(self, context: zmq.asyncio.Context, session: ClientSession) -> None:
+        self.session = session
         self.clients_socket = context.socket(zmq.ROUTER)
         self.events_socket = context.socket(zmq.SUB)
 
-        # Socket identity -> Client
-        self.clients: dict[bytes, Client] = {}
+        # Route -> Client
+        self.clients: dict[Route, Client] = {}
 
         self.max_level_id = 10_000
 
@@ -476,38 +664,59 @@ class Manager:
         while True:
             events = dict(await poller.poll())
 
+            # Handle everything that has queued up since the last poll. Frames
+            # are not copied out of libzmq, the decoders read them in place.
             if events.get(self.clients_socket) == zmq.POLLIN:
-                identity, data = await self.clients_socket.recv_multipart()
-                message = messages.load(data)
-                if message is not None:
-                    await self.handle_message(identity, message)
-                else:
-                    logger.warning("Received invalid message: %s", message)
+                while True:
+                    try:
+                        *route, data = await self.clients_socket.recv_multipart(
+                            zmq.NOBLOCK, copy=False
+                        )
+                    except zmq.Again:
+                        break
+                    message = messages.load_request(data.buffer)
+                    if message is not None:
+                        await self.handle_message(
+                            tuple(part.bytes for part in route), message
+                        )
+                    else:
+                        logger.warning("Received invalid message: %s", data.bytes)
 
             if events.get(self.events_socket) == zmq.POLLIN:
-                (data,) = await self.events_socket.recv_multipart()
-                event = Event.parse_raw(data)
-                await self.handle_dustkid_event(event)
-
-    async def handle_message(self, identity: bytes, message: messages.Message):
-        logger.debug(
-            "Handling frontend message: identity=%s message=%s", identity, message
-        )
+                while True:
+                    try:
+                        frames = await self.events_socket.recv_multipart(
+                            zmq.NOBLOCK, copy=False
+                        )
+                    except zmq.Again:
+                        break
+                    for data in frames:
+                        try:
+                            event = EVENT_DECODER.decode(data.buffer)
+                        except msgspec.DecodeError as error:
+                            logger.warning(
+                                "Could not parse event: %s\n%s", data.bytes, error
+                            )
+                            continue
+                        self.handle_dustkid_event(event)
+
+    async def handle_message(self, route: Route, message: messages.Request):
+        logger.debug("Handling frontend message: route=%s message=%s", route, message)
         if message["type"] == "create_lobby":
-            await self.handle_create_lobby(identity)
+            await self.handle_create_lobby(route)
         elif message["type"] == "join":
-            await self.handle_join(identity, message["lobby_id"])
+            await self.handle_join(route, message["lobby_id"])
         elif message["type"] == "leave":
-            await self.handle_leave(identity)
+            await self.handle_leave(route)
         elif message["type"] == "login":
-            await self.handle_login(identity, message["user_id"])
+            await self.handle_login(route, message["user_id"])
         elif message["type"] == "logout":
-            await self.handle_logout(identity)
+            await self.handle_logout(route)
         else:
             logger.warning("Received unknown message type: %s", message)
 
-    async def handle_create_lobby(self, identity: bytes) -> None:
-        lobby = Lobby.create()
+    async def handle_create_lobby(self, route: Route) -> None:
+        lobby = Lobby.create(self.session)
 
         response: messages.Error | messages.CreatedLobby
         if lobby is None:
@@ -516,13 +725,13 @@ class Manager:
             response = {"type": "created_lobby", "lobby_id": lobby.id}
 
         await self.clients_socket.send_multipart(
-            [identity, messages.dump_bytes(response)]
+            [*route, messages.dump_bytes(response)]
         )
 
-    async def handle_join(self, identity: bytes, lobby_id: int) -> None:
-        if identity in self.clients:
+    async def handle_join(self, route: Route, lobby_id: int) -> None:
+        if route in self.clients:
             logger.warning(
-                "Duplicate client join: identity=%s lobby_id=%s", identity, lobby_id
+                "Duplicate client join: route=%s lobby_id=%s", route, lobby_id
             )
             return
 
@@ -534,72 +743,87 @@ class Manager:
 
         client = Client(
             socket=self.clients_socket,
-            identity=identity,
+            route=route,
             user=None,
             lobby=lobby,
         )
-        self.clients[identity] = client
+        self.clients[route] = client
 
         await lobby.on_join(client)
         # TODO: Send back success response
 
-    async def handle_leave(self, identity: bytes) -> None:
-        if identity not in self.clients:
-            logger.warning("Unknown client left: identity=%s", identity)
+    async def handle_leave(self, route: Route) -> None:
+        if route not in self.clients:
+            logger.warning("Unknown client left: route=%s", route)
             return
 
-        client = self.clients.pop(identity)
+        client = self.clients.pop(route)
         lobby = client.lobby
 
         await lobby.on_leave(client)
 
-    async def handle_login(self, identity: bytes, user_id: int) -> None:
-        if identity not in self.clients:
+    async def handle_login(self, route: Route, user_id: int) -> None:
+        if route not in self.clients:
             logger.warning(
-                "Unknown client logged in: identity=%s user_id=%s", identity, user_id
+                "Unknown client logged in: route=%s user_id=%s", route, user_id
             )
             return
 
-        client = self.clients[identity]
+        client = self.clients[route]
 
-        user = await User.create(user_id)
+        user = await User.create(user_id, self.session)
         if user is None:
             # TODO: Send back BadRequest
             return
 
-        client.user = user
-        await client.lobby.send_state()
+        client.lobby.on_login(client, user)
 
-    async def handle_logout(self, identity: bytes) -> None:
-        if identity not in self.clients:
-            logger.warning("Unknown client logged out: identity=%s", identity)
+    async def handle_logout(self, route: Route) -> None:
+        if route not in self.clients:
+            logger.warning("Unknown client logged out: route=%s", route)
             return
 
-        client = self.clients[identity]
-        client.user = None
-        await client.lobby.send_state()
+        client = self.clients[route]
+        client.lobby.on_login(client, None)
 
-    async def handle_dustkid_event(self, event: Event) -> None:
+    def handle_dustkid_event(self, event: Event) -> None:
         logger.debug("Received dustkid event: %s", event)
 
-        level_id = Level(event.level).id
+        # Many events share a handful of levels, so this is usually cached
+        level_id = parse_level_id(event.level)
         if level_id is not None and level_id > self.max_level_id:
             logger.info("Found more recently uploaded level: id=%s", level_id)
             self.max_level_id = level_id
 
-        for lobby in list(Lobby.lobbies.values()):
-            await lobby.on_dustkid_event(event)
+        for lobby in Lobby.by_level.get(event.level, ()):
+            # One broken lobby should not stop the others getting the event
+            try:
+                lobby.on_dustkid_event(event)
+            except Exception:
+                logger.exception(
+                    "Lobby(%s) could not handle dustkid event: %s", lobby.id, event
+                )
 
 
 async def main() -> None:
-    with zmq.asyncio.Context() as context:
-        done, _ = await asyncio.wait(
-            [
-                asyncio.create_task(dustkid_events(context)),
-                asyncio.create_task(Manager(context).run()),
-            ],
-            return_when=asyncio.FIRST_COMPLETED,
-        )
+    # Start tasks immediately, skipping a loop iteration when they never block
+    asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
+    # Share one connection pool between all requests to the dustforce sites
+    connector = TCPConnector(
+        limit=100, limit_per_host=20, ttl_dns_cache=300, keepalive_timeout=60
+    )
+    async with ClientSession(
+        connector=connector, timeout=ClientTimeout(total=10)
+    ) as session:
+        with zmq.asyncio.Context() as context:
+            done, _ = await asyncio.wait(
+                [
+                    asyncio.create_task(dustkid_events(context)),
+                    asyncio.create_task(Manager(context, session).run()),
+                ],
+                return_when=asyncio.FIRST_COMPLETED,
+            )
 
     for future in done:
         try:
@@ -609,4 +833,4 @@ async def main() -> None:
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    uvloop.run(main())
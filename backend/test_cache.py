@@ -0,0 +1,98 @@
+import asyncio
+import unittest
+from datetime import timedelta
+
+from cache import TTLCache
+
+
+class TestTTLCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.cache: TTLCache[int, int] = TTLCache(timedelta(minutes=1))
+        self.started = asyncio.Event()
+        self.finish = asyncio.Event()
+        self.cancelled = False
+
+    async def fetch(self) -> int:
+        self.started.set()
+        try:
+            await self.finish.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return 1
+
+    async def test_concurrent_callers_share_a_fetch(self):
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await self.finish.wait()
+            return 1
+
+        callers = [asyncio.create_task(self.cache.get(0, fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        self.finish.set()
+
+        self.assertEqual(await asyncio.gather(*callers), [1, 1, 1])
+        self.assertEqual(calls, 1)
+
+    async def test_cancelling_the_last_caller_cancels_the_fetch(self):
+        caller = asyncio.create_task(self.cache.get(0, self.fetch))
+        await self.started.wait()
+
+        caller.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await caller
+        await asyncio.sleep(0)
+
+        self.assertTrue(self.cancelled)
+        self.assertFalse(self.cache._pending)
+        self.assertFalse(self.cache._waiters)
+
+    async def test_cancelling_one_caller_keeps_the_fetch(self):
+        first = asyncio.create_task(self.cache.get(0, self.fetch))
+        second = asyncio.create_task(self.cache.get(0, self.fetch))
+        await self.started.wait()
+
+        first.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await first
+        self.finish.set()
+
+        self.assertEqual(await second, 1)
+        self.assertFalse(self.cancelled)
+
+    async def test_cancelled_callers_release_a_shared_limit(self):
+        limit = asyncio.Semaphore(2)
+        running = most_running = 0
+
+        async def fetch():
+            nonlocal running, most_running
+            running += 1
+            most_running = max(most_running, running)
+            try:
+                await self.finish.wait()
+            finally:
+                running -= 1
+            return 1
+
+        async def limited_get(key: int) -> int:
+            async with limit:
+                return await self.cache.get(key, fetch)
+
+        for batch in range(2):
+            callers = [
+                asyncio.create_task(limited_get(batch * 2 + i)) for i in range(2)
+            ]
+            await asyncio.sleep(0)
+            for caller in callers:
+                caller.cancel()
+            await asyncio.gather(*callers, return_exceptions=True)
+
+        self.assertEqual(most_running, 2)
+        self.assertEqual(running, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
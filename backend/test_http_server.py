@@ -0,0 +1,22 @@
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+import http_server
+
+
+class TestCreateLobby(unittest.IsolatedAsyncioTestCase):
+    async def test_lost_reply_times_out(self):
+        # Nothing is listening for the request, so no reply ever comes
+        with mock.patch.object(http_server, "BACKEND_TIMEOUT", timedelta(seconds=0.1)):
+            async with http_server.app.test_app() as app:
+                client = app.test_client()
+                response = await client.post("/api/create_lobby")
+                self.assertEqual(response.status_code, 504)
+                # The socket that timed out was replaced in the pool
+                pool = http_server.app.backend_pool
+                self.assertEqual(pool.qsize(), http_server.BACKEND_POOL_SIZE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import messages
+import server
+import zmq
+import zmq.asyncio
+from constants import CLIENTS_URL
+
+STATE = messages.dump_bytes(
+    messages.State(
+        lobby_id=0,
+        level=None,
+        round_timer=None,
+        winner=None,
+        break_timer=None,
+        users={},
+        scores=[],
+    )
+)
+
+
+async def never_finish(*args, **kwargs):
+    await asyncio.Event().wait()
+
+
+class TestManager(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.context = zmq.asyncio.Context()
+        self.manager = server.Manager(self.context, session=mock.Mock())
+        self.manager_task = asyncio.create_task(self.manager.run())
+
+        self.client = self.context.socket(zmq.DEALER)
+        self.client.connect(CLIENTS_URL)
+
+    async def asyncTearDown(self):
+        self.manager_task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await self.manager_task
+        for lobby in list(server.Lobby.lobbies.values()):
+            lobby.on_close.set()
+        await asyncio.sleep(0)
+        self.client.close(linger=0)
+        self.manager.clients_socket.close(linger=0)
+        self.manager.events_socket.close(linger=0)
+        self.context.term()
+
+    async def test_state_message_is_ignored(self):
+        # New lobbies look for a level, which would go out to atlas
+        with mock.patch.object(server, "random_level", never_finish):
+            await self.client.send(STATE)
+            # The manager is still running and answering requests
+            await self.client.send(messages.dump_bytes({"type": "create_lobby"}))
+            response = await asyncio.wait_for(self.client.recv(), 5)
+
+        self.assertFalse(self.manager_task.done())
+        self.assertEqual(messages.load(response)["type"], "created_lobby")
+
+
+class TestRandomLevel(unittest.IsolatedAsyncioTestCase):
+    async def test_retries_when_no_level_is_found(self):
+        level = server.Level("How-Do-I-Boost-5518")
+        calls = 0
+
+        async def try_random_level(*args):
+            # Every attempt in the first batch misses
+            nonlocal calls
+            calls += 1
+            return level if calls > server.RANDOM_LEVEL_ATTEMPTS else None
+
+        with mock.patch.object(server, "try_random_level", try_random_level):
+            found = await server.random_level(mock.Mock(), max_level_id=10_000)
+
+        self.assertEqual(found, level)
+        self.assertGreater(calls, server.RANDOM_LEVEL_ATTEMPTS)
+
+
+class TestLoadRequest(unittest.TestCase):
+    def test_rejects_state(self):
+        self.assertIsNone(messages.load_request(STATE))
+
+    def test_accepts_join(self):
+        self.assertEqual(
+            messages.load_request(b'{"type":"join","lobby_id":3}'),
+            {"type": "join", "lobby_id": 3},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
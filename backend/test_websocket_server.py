@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+
+from websocket_server import WebsocketHandler
+
+
+def state(lobby_id: int) -> bytes:
+    return b'{"type":"state","lobby_id":%d}' % lobby_id
+
+
+class SlowWebsocket:
+    """Records sent messages, with each send waiting until it is released."""
+
+    def __init__(self):
+        self.sent: list[str] = []
+        self.release = asyncio.Event()
+
+    async def send(self, message: str) -> None:
+        self.sent.append(message)
+        await self.release.wait()
+        self.release.clear()
+
+
+class TestPendingState(unittest.IsolatedAsyncioTestCase):
+    async def test_slow_reader_only_gets_the_newest_state(self):
+        websocket = SlowWebsocket()
+        handler = WebsocketHandler(websocket)
+        pump = asyncio.create_task(handler.pump_states())
+        try:
+            handler.handle_backend_event(state(1))
+            await asyncio.sleep(0)
+            # These all arrive while the first state is still being sent
+            for lobby_id in range(2, 10):
+                handler.handle_backend_event(state(lobby_id))
+            self.assertEqual(handler.pending_state, state(9).decode())
+
+            websocket.release.set()
+            await asyncio.sleep(0)
+            self.assertEqual(websocket.sent, [state(1).decode(), state(9).decode()])
+        finally:
+            pump.cancel()
+
+    async def test_non_state_events_are_not_sent(self):
+        handler = WebsocketHandler(SlowWebsocket())
+        handler.handle_backend_event(b'{"type":"error"}')
+        self.assertIsNone(handler.pending_state)
+        self.assertFalse(handler.state_ready.is_set())
+
+
+class TestPing(unittest.IsolatedAsyncioTestCase):
+    async def test_json_ping_gets_a_pong(self):
+        websocket = SlowWebsocket()
+        websocket.release.set()
+        handler = WebsocketHandler(websocket)
+
+        await handler.handle_websocket_event('{"type":"ping"}')
+
+        self.assertEqual(websocket.sent, ['{"type":"pong"}'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,11 @@
+from __future__ import annotations
+
 import asyncio
 import logging
-from urllib.parse import parse_qs, urlparse
+import uuid
 
 import messages
+import uvloop
 import websockets
 import zmq
 import zmq.asyncio
@@ -12,88 +15,173 @@ from websockets.exceptions import ConnectionClosedError, ConnectionClosedOK
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# How often to ping each websocket, and how long it has to answer before the
+# connection is closed. The pings are protocol level, so websockets answers
+# them without waking up the handler.
+PING_INTERVAL = 20
+PING_TIMEOUT = 20
+
+# These never change, so only encode them once
+LEAVE = messages.dump_bytes({"type": "leave"})
+PONG = messages.dump_str({"type": "pong"})
+# Only the lobby id varies, so format it straight into the encoded message
+JOIN_TEMPLATE = b'{"type":"join","lobby_id":%d}'
+
 
 class WebsocketHandler:
+
+    # One socket is shared by every connection, with each message prefixed by
+    # the id of the connection it is for
+    backend: zmq.asyncio.Socket
+
+    # Connection id -> WebsocketHandler
+    handlers: dict[bytes, WebsocketHandler] = {}
+
+    @classmethod
+    def connect_backend(cls, context: zmq.asyncio.Context) -> None:
+        cls.backend = context.socket(zmq.DEALER)
+        # Every connection's messages share this socket, so allow far more to
+        # queue than the default of 1000 before sends start waiting
+        cls.backend.setsockopt(zmq.SNDHWM, 100_000)
+        cls.backend.setsockopt(zmq.RCVHWM, 100_000)
+        # Only queue messages once the backend is actually connected
+        cls.backend.setsockopt(zmq.IMMEDIATE, 1)
+        # Notice a backend that has gone away instead of queueing for it
+        cls.backend.setsockopt(zmq.TCP_KEEPALIVE, 1)
+        # Do not hang on shutdown sending to a backend that is not there
+        cls.backend.setsockopt(zmq.LINGER, 0)
+        cls.backend.connect(CLIENTS_URL)
+
+    @classmethod
+    async def route_backend_events(cls) -> None:
+        """Pass each message from the backend to the connection it is for."""
+        while True:
+            frames = await cls.backend.recv_multipart()
+            # Handle everything else that has queued up without waiting again
+            while True:
+                cls.route_backend_event(frames)
+                try:
+                    frames = await cls.backend.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+
+    @classmethod
+    def route_backend_event(cls, frames: list[bytes]) -> None:
+        if len(frames) != 2:
+            logger.warning("Recieved invalid backend frames: %s", frames)
+            return
+
+        id, data = frames
+        handler = cls.handlers.get(id)
+        if handler is None:
+            # The connection has already closed
+            return
+        handler.handle_backend_event(data)
+
     @classmethod
     async def create(cls, websocket):
         await cls(websocket).run()
 
     def __init__(self, websocket):
         self.websocket = websocket
-
-        context = zmq.asyncio.Context.instance()
-        self.backend = context.socket(zmq.DEALER)
-        self.backend.connect(CLIENTS_URL)
+        self.id = uuid.uuid4().bytes
+        # The newest encoded state that has not been sent to the websocket yet.
+        # Each state replaces the last, so a slow reader never falls behind by
+        # more than one.
+        self.pending_state: str | None = None
+        self.state_ready = asyncio.Event()
 
     async def run(self) -> None:
+        # The only parameter is a numeric lobby id, so there is nothing to
+        # unquote and the query can just be split up
+        query = self.websocket.path.partition("?")[2]
+        params = dict(param.partition("=")[::2] for param in query.split("&"))
         try:
-            params = parse_qs(urlparse(self.websocket.path).query)
-        except ValueError as error:
-            logger.warning("Could not parse path: %s\n%s", self.websocket.path, error)
-            return
-
-        try:
-            lobby_id = int(params["lobby"][0])
-        except (ValueError, KeyError, IndexError):
+            lobby_id = int(params["lobby"])
+        except (ValueError, KeyError):
             return
 
-        logger.info("Sending Join(lobby_id=%s)", lobby_id)
-        await self.backend.send(
-            messages.dump_bytes({"type": "join", "lobby_id": lobby_id})
-        )
-
+        WebsocketHandler.handlers[self.id] = self
         try:
-            read_websocket = asyncio.create_task(self.websocket.recv())
-            read_backend = self.backend.recv()
-            pending = {read_websocket, read_backend}
-            while True:
-                done, pending = await asyncio.wait(
-                    pending, return_when=asyncio.FIRST_COMPLETED
-                )
-
-                if read_websocket in done:
-                    await self.handle_websocket_event(await read_websocket)
-                    read_websocket = asyncio.create_task(self.websocket.recv())
-                    pending.add(read_websocket)
-
-                if read_backend in done:
-                    await self.handle_backend_event(await read_backend)  # type: ignore
-                    read_backend = self.backend.recv()
-                    pending.add(read_backend)
-        except ConnectionClosedOK:
+            async with asyncio.TaskGroup() as group:
+                # Messages to the websocket are sent in the background, and an
+                # error on either side cancels the other
+                states = group.create_task(self.pump_states())
+
+                logger.info("Sending Join(lobby_id=%s)", lobby_id)
+                await self.send_backend(JOIN_TEMPLATE % lobby_id)
+                await self.pump_websocket()
+
+                # The websocket closed cleanly, so nothing else can be sent
+                states.cancel()
+        except* ConnectionClosedOK:
             pass
-        except ConnectionClosedError as error:
-            logger.warning("Connection closed with an error: %s", error)
+        except* ConnectionClosedError as errors:
+            logger.warning("Connection closed with an error: %s", errors.exceptions[0])
         finally:
             logger.info("Sending Leave()")
-            self.backend.send(messages.dump_bytes({"type": "leave"}))
+            await self.send_backend(LEAVE)
+            del WebsocketHandler.handlers[self.id]
+
+    async def send_backend(self, data: bytes) -> None:
+        await self.backend.send_multipart([self.id, data])
+
+    async def pump_websocket(self) -> None:
+        # Stops when the websocket closes cleanly
+        async for data in self.websocket:
+            await self.handle_websocket_event(data)
+
+    async def pump_states(self) -> None:
+        while True:
+            await self.state_ready.wait()
+            self.state_ready.clear()
+            state, self.pending_state = self.pending_state, None
+            await self.websocket.send(state)
 
     async def handle_websocket_event(self, data: bytes | str) -> None:
-        message = messages.load(data)
+        if messages.load_type(data) == "ping":
+            # TODO: Remove once frontends that send pings have been reloaded
+            await self.websocket.send(PONG)
+            return
+
+        message = messages.load_request(data)
         if message is None:
             logger.warning("Recieved invalid websocket event: %s", data)
             return
 
         logger.debug("Recieved websocket event: %s", message)
-        if message["type"] == "ping":
-            await self.websocket.send(messages.dump_str({"type": "pong"}))
-        else:
-            await self.backend.send(messages.dump_bytes(message))
-
-    async def handle_backend_event(self, data: bytes) -> None:
-        message = messages.load(data)
-        if message is None:
-            logger.warning("Recieved invalid backend event: %s", data)
+        await self.send_backend(messages.dump_bytes(message))
+
+    def handle_backend_event(self, data: bytes) -> None:
+        # The backend already sends encoded messages, so they are passed on as
+        # they are. They go out as text frames, since that is what the browser
+        # expects to parse.
+        logger.debug("Recieved backend event: %s", data)
+        if messages.load_type(data) != "state":
+            # States are the only messages the backend sends to a websocket
+            logger.warning("Recieved unexpected backend event: %s", data)
             return
-
-        logger.debug("Recieved backend event: %s", message)
-        await self.websocket.send(messages.dump_str(message))
+        self.pending_state = data.decode()
+        self.state_ready.set()
 
 
 async def main() -> None:
-    async with websockets.serve(WebsocketHandler.create, host="0.0.0.0", port=8000):  # type: ignore
-        await asyncio.Future()
+    # Start tasks immediately, skipping a loop iteration when they never block
+    asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+
+    # Start the I/O threads before any connections arrive. All the traffic goes
+    # through the one backend socket, so give it a second thread.
+    context = zmq.asyncio.Context.instance(io_threads=2)
+    WebsocketHandler.connect_backend(context)
+    async with websockets.serve(
+        WebsocketHandler.create,  # type: ignore
+        host="0.0.0.0",
+        port=8000,
+        ping_interval=PING_INTERVAL,
+        ping_timeout=PING_TIMEOUT,
+    ):
+        await WebsocketHandler.route_backend_events()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    uvloop.run(main())
@@ -52,9 +52,6 @@ class ReconnectingWebSocket {
     this.attempts = 0;
     this.closed = false;
 
-    this.pingTimer = null;
-    this.pongTimer = null;
-
     this.onmessage = () => {};
     this.onclose = () => {};
 
@@ -69,13 +66,11 @@ class ReconnectingWebSocket {
     if (this.closed) return;
 
     this.ws = new WebSocket(this.url);
-    this.ws.onmessage = (event) => {
-      this.heartbeat();
-      this.onmessage(event);
-    };
+    // The server pings the connection at the protocol level and closes it if
+    // the browser stops answering, which fires onclose below
+    this.ws.onmessage = (event) => this.onmessage(event);
     this.ws.onopen = (event) => {
       this.attempts = 0;
-      this.heartbeat();
     };
     this.ws.onclose = (event) => {
       if (event.wasClean) this.close();
@@ -84,8 +79,6 @@ class ReconnectingWebSocket {
   }
 
   reconnect() {
-    clearTimeout(this.pingTimer);
-    clearTimeout(this.pongTimer);
     this.ws.close();
     ++this.attempts;
     setTimeout(
@@ -94,22 +87,9 @@ class ReconnectingWebSocket {
     );
   }
 
-  heartbeat() {
-    clearTimeout(this.pingTimer);
-    clearTimeout(this.pongTimer);
-    this.pingTimer = setTimeout(() => this.ping(), 5000);
-  }
-
-  ping() {
-    this.ws.send(JSON.stringify({ type: "ping" }));
-    this.pongTimer = setTimeout(() => this.reconnect(), 5000);
-  }
-
   close() {
     if (this.closed) return;
     this.closed = true;
-    clearTimeout(this.pingTimer);
-    clearTimeout(this.pongTimer);
     this.ws.close();
     this.onclose();
   }
@@ -179,9 +159,7 @@ function Matchmaking() {
 
     const { type, ...args } = data;
 
-    if (type === "pong") {
-      console.debug("Got pong");
-    } else if (type === "state") {
+    if (type === "state") {
       console.debug("Received new state", args);
       setState(args);
     } else {